@@ -28,7 +28,9 @@ monitoring API inspired by inotifyx and an enhanced interface inspired by
 pyinotify (but hopefully a bit easier to use).
 """
 
+import errno
 import os
+import sys
 import threading
 import binding
 
@@ -49,13 +51,24 @@ class INotify(object):
         Note: See inotify_init(2) for further details.
         """
 
+        # nothing to clean up in __del__ unless both descriptors are opened
+        self._closed = True
         self._fd = binding.init()
+        try:
+            self._wake_fd = binding.init_wake()
+        except:
+            binding.close(self._fd)
+            raise
         self._closed = False
 
+    # kept on the class so it is still reachable from __del__ during
+    # interpreter shutdown, when module globals may already be cleared
+    _close_fd = staticmethod(binding.close)
+
     def __del__(self):
         """Cleans up the inotify instance.
 
-        Closes the file descriptor opened by the constructor.
+        Closes the file descriptors opened by the constructor.
 
         Note: See inotify_init(2) for further details.
         """
@@ -63,16 +76,14 @@ class INotify(object):
         self.close()
 
     def close(self):
-        """Closes the file descriptor opened by the constructor.
+        """Closes the file descriptors opened by the constructor.
 
         Note: Do not try to use the instance after calling this function.
         """
         if not self._closed:
             self._closed = True
-            try:
-                os.close(self._fd)
-            except OSError:
-                pass
+            self._close_fd(self._fd)
+            self._close_fd(self._wake_fd)
 
     def add_watch(self, path, mask=IN_ALL_EVENTS):
         """Adds a new watch, or modifies an existing watch.
@@ -126,7 +137,8 @@ class INotify(object):
         Returns:
             A list of tuples of wd, mask, cookie and name in that order. If
             there is no name associated with the event the name will be an empty
-            string.
+            string. The list may be empty if the wait was interrupted by a
+            wake up from INotifyThreaded.stop().
 
         Raises:
             IOError: On error.
@@ -134,7 +146,82 @@ class INotify(object):
         Note: See inotify(7) for a detailed description of the returned fields.
         """
 
-        return binding.get_events(self._fd, timeout)
+        return binding.get_events(self._fd, timeout, self._wake_fd)
+
+    def get_events_columns(self, timeout=None):
+        """Get inotify events as columns rather than one object per event.
+
+        Args:
+            timeout: Specifies a timeout as a floating point number in seconds.
+                A timeout of None will cause get_event to block until an event
+                occurs. A timeout of zero specifies a poll and never blocks.
+
+        Returns:
+            A tuple of wds, masks, cookies and names in that order. The wds are
+            an array.array('i'), the masks and cookies are array.array('I')s
+            and the names are a list with an empty string for events without a
+            name. Element i of each belongs to the same event. All four are
+            empty if there are no events.
+
+        Raises:
+            IOError: On error.
+
+        Note: This suits callers aggregating over many events, e.g. counting
+            events per watch descriptor. No per event objects are created and
+            no INotifyEnhanced watch tracking is performed on the events.
+
+        Note: See INotify.get_events() for further information.
+        """
+
+        return binding.get_events_columns(self._fd, timeout, self._wake_fd)
+
+    def get_events_masked(self, mask_filter, timeout=None):
+        """Get the inotify events matching a mask as columns.
+
+        Args:
+            mask_filter: Bitmask of events to keep. An event is kept if its
+                mask has any of these bits set.
+            timeout: Specifies a timeout as a floating point number in seconds.
+                A timeout of None will cause get_event to block until an event
+                occurs. A timeout of zero specifies a poll and never blocks.
+
+        Returns:
+            A tuple of wds, masks, cookies and names as for
+            get_events_columns() but holding only the matching events and with
+            the wds, masks and cookies as numpy int32, uint32 and uint32
+            arrays.
+
+        Raises:
+            IOError: On error.
+            ImportError: If numpy is not available.
+
+        Note: The filtering is vectorised with numpy, there is no per event
+            Python code other than collecting the matching names.
+
+        Note: See INotify.get_events_columns() for further information.
+        """
+
+        # numpy is optional and only imported when it is needed
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("get_events_masked() requires numpy")
+
+        wds, masks, cookies, names = self.get_events_columns(timeout)
+
+        # frombuffer() does not accept empty buffers on older numpy
+        if not names:
+            return (numpy.zeros(0, numpy.int32), numpy.zeros(0, numpy.uint32),
+                numpy.zeros(0, numpy.uint32), [])
+
+        wds = numpy.frombuffer(wds, numpy.int32)
+        masks = numpy.frombuffer(masks, numpy.uint32)
+        cookies = numpy.frombuffer(cookies, numpy.uint32)
+
+        selected = numpy.nonzero(masks & numpy.uint32(mask_filter))[0]
+
+        return (wds[selected], masks[selected], cookies[selected],
+            [names[i] for i in selected])
 
 INE_AUTO_ADD = 0x01
 """Automatically add watches to directories created on watched path."""
@@ -142,30 +229,16 @@ INE_AUTO_ADD = 0x01
 INE_REMOVE_MOVED = 0x02
 """Automatically remove watch if the watch is itself moved."""
 
-class INotifyEvent(object):
+class INotifyEvent(binding.Event):
     """Basic class representing and inotify event.
 
+    The wd, mask, cookie and name fields are stored as C values by the
+    binding.Event base type rather than in an instance dictionary.
+
     Note: See inotify(7) for further details.
     """
 
-    def __init__(self, wd, mask, cookie, name):
-
-        self.__wd = wd
-        self.__mask = mask
-        self.__cookie = cookie
-        self.__name = name
-
-    wd = property(lambda self: self.__wd, None, None,
-    """Watch descriptor associated with event.""")
-
-    mask = property(lambda self: self.__mask, None, None, 
-    """Event mask.""")
-
-    cookie = property(lambda self: self.__cookie, None, None,
-    """Event cookie.""")
-
-    name = property(lambda self: self.__name, None, None,
-    """Event name.""")
+    __slots__ = ()
 
     def __str__(self):
 
@@ -179,36 +252,46 @@ class INotifyEvent(object):
 class INotifyWatch(object):
     """Basic class representing and inotify watch.
 
+    Attributes:
+        wd: Watch descriptor.
+        path: Path that watch was added to (at the time it was added).
+        inode_path: Path of the inode that watch was added to (a the time it
+            was added).
+        mask: Bitmask of events to watch for.
+        flags: Enhanced inotify flags.
+
     Note: If you want to modify a watch use add_watch() with the modified
-        values.
+        values. The attributes should be treated as read only.
 
-    Note: The inode_path and path properties will become invalid when a watch is
+    Note: The inode_path and path attributes will become invalid when a watch is
         itself moved as there is no way to track the destination of the move
         operation.
     """
 
-    def __init__(self, wd, path, inode_path, mask, flags=0):
-
-        self.__wd = wd
-        self.__path = path
-        self.__inode_path = inode_path
-        self.__mask = mask
-        self.__flags = flags
+    __slots__ = ("wd", "path", "inode_path", "mask", "flags",
+        "_auto_add_bits", "_move_self_bits")
 
-    wd = property(lambda self: self.__wd, None, None,
-    """Watch descriptor.""")
+    def __init__(self, wd, path, inode_path, mask, flags=0):
 
-    path = property(lambda self: self.__path, None, None,
-    """Path that watch was added to (at the time it was added).""")
+        self.wd = wd
+        self.path = path
+        self.inode_path = inode_path
+        self.mask = mask
+        self.flags = flags
 
-    inode_path = property(lambda self: self.__inode_path, None, None,
-    """Path of the inode that watch was added to (a the time it was added).""")
+        # event bits acted on by get_events() (zero when the flag is not set)
+        self._auto_add_bits = 0
+        if flags & INE_AUTO_ADD:
+            self._auto_add_bits = IN_CREATE | IN_MOVED_TO
+        self._move_self_bits = 0
+        if flags & INE_REMOVE_MOVED:
+            self._move_self_bits = IN_MOVE_SELF
 
-    mask = property(lambda self: self.__mask, None, None,
-    """Bitmask of events to watch for.""")
+    def __reduce__(self):
 
-    flags = property(lambda self: self.__flags, None, None,
-    """Enhanced inotify flags.""")
+        # __slots__ leaves no __dict__ to pickle, rebuild via __init__ instead
+        return (self.__class__, (self.wd, self.path, self.inode_path,
+            self.mask, self.flags))
 
     def __str__(self):
 
@@ -262,8 +345,11 @@ class INotifyEnhanced(INotify):
 
         INotify.__init__(self)
         self.__watches = {}
-        self.__paths_to_watches = {}
-        self.__inode_paths_to_watches = {}
+        self.__path_to_wd = {}
+        self.__inode_path_to_wd = {}
+
+        # number of watches with enhanced flags set
+        self.__flagged_watches = 0
 
     def add_watch(self, path, mask=IN_ALL_EVENTS, flags=0):
         """Adds a new watch, or modifies an existing watch.
@@ -283,30 +369,15 @@ class INotifyEnhanced(INotify):
         Note: See INotify.add_watch() for further information.
         """
 
-        m = mask
-
-        # auto add
-        if flags & INE_AUTO_ADD:
-            m |= IN_CREATE | IN_MOVED_TO
-
-        # auto remove moved
-        if flags & INE_REMOVE_MOVED:
-            m |= IN_MOVE_SELF
-
         # add watch
-        wd = INotify.add_watch(self, path, m)
+        wd = INotify.add_watch(self, path, self._inotify_mask(mask, flags))
 
         # get inode path
         inode_path = path
-        if not m & IN_DONT_FOLLOW:
+        if not mask & IN_DONT_FOLLOW:
             inode_path = os.path.realpath(path)
 
-        watch = INotifyWatch(wd, path, inode_path, mask, flags)
-        self.__watches[wd] = watch
-        self.__paths_to_watches[path] = watch
-        self.__inode_paths_to_watches[inode_path] = watch
-
-        return watch
+        return self._add_watch(wd, path, inode_path, mask, flags)
 
     def add_watches(self, path, mask=IN_ALL_EVENTS, flags=0, topdown=True):
         """Recursively adds new watches, or modifies existing watches.
@@ -329,21 +400,120 @@ class INotifyEnhanced(INotify):
             directory when it is opened/closed to scan for child directories.
             Setting topdown to False prevents this behaviour.
 
+        Note: As with os.walk() directories that cannot be listed are skipped,
+            so no watches are added if path is not a directory.
+
         Note: See INotifyEnhanced.add_watch() for further information.
         """
 
-        # should we follow symlinks
-        follow = True
-        if mask & IN_DONT_FOLLOW:
-            follow = False
+        return self._add_watches(path, mask, flags, topdown)[0]
 
-        # walk path adding watches to directories
+    def _add_watches(self, path, mask, flags, topdown):
+        """Recursively adds new watches, or modifies existing watches.
+
+        Internal add_watches that also returns the errno path could not be
+        listed with, or 0 if it was walked.
+        """
+
+        # the binding walks byte paths so unicode paths are encoded, and the
+        # walked paths decoded again, the same way os.walk() would
+        top = path
+        encoding = None
+        if isinstance(path, unicode):
+            encoding = sys.getfilesystemencoding()
+            top = path.encode(encoding)
+
+        # walk path adding watches to directories (in the binding), tracking
+        # any watches added even if the walk fails part way through
+        results = []
         watches = []
-        for root, dirs, files in os.walk(path, topdown, followlinks=follow):
-            watch = self.add_watch(root, mask, flags)
-            watches.append(watch)
+        try:
+            error = binding.add_watch_tree(self._fd, top,
+                self._inotify_mask(mask, flags), topdown, results)
+        finally:
+            for i, (wd, root) in enumerate(results):
+                if root == top:
+                    root = path
+                elif encoding is not None:
+                    try:
+                        root = root.decode(encoding)
+                    except UnicodeDecodeError:
+                        pass
+                results[i] = wd, root
+            inode_paths = {}
+            if not mask & IN_DONT_FOLLOW:
+                inode_paths = self._inode_paths(results, topdown)
+            for wd, root in results:
+                inode_path = inode_paths.get(root, root)
+                watch = self._add_watch(wd, root, inode_path, mask, flags)
+                watches.append(watch)
+
+        return watches, error
+
+    def _inode_paths(self, results, topdown):
+        """Get the inode paths of the directories returned by a walk.
+
+        Each directory that is not itself a symlink is resolved by joining its
+        name to the already resolved path of its parent, so realpath() (which
+        lstat()s every component) is only used for the top of the walk and
+        for symlinks.
+        """
 
-        return watches
+        # parents must be resolved before their children
+        if not topdown:
+            results = reversed(results)
+
+        inode_paths = {}
+        for wd, root in results:
+            parent, name = os.path.split(root)
+            inode_parent = inode_paths.get(parent)
+            if inode_parent is None or os.path.islink(root):
+                inode_paths[root] = os.path.realpath(root)
+            else:
+                inode_paths[root] = os.path.join(inode_parent, name)
+
+            # only the top can end in a slash, which split() drops
+            if root.endswith('/'):
+                inode_paths[os.path.dirname(os.path.join(root, ''))] = \
+                    inode_paths[root]
+
+        return inode_paths
+
+    def _inotify_mask(self, mask, flags):
+        """Get the inotify mask needed for the enhanced flags."""
+
+        m = mask
+
+        # auto add
+        if flags & INE_AUTO_ADD:
+            m |= IN_CREATE | IN_MOVED_TO
+
+        # auto remove moved
+        if flags & INE_REMOVE_MOVED:
+            m |= IN_MOVE_SELF
+
+        return m
+
+    def _add_watch(self, wd, path, inode_path, mask, flags):
+        """Add watch.
+
+        Internal add_watch only called once inotify has added the watch to
+        keep track of it.
+        """
+
+        # a watch on the same inode replaces any existing watch
+        old = self.__watches.get(wd)
+        if old is not None and old.flags:
+            self.__flagged_watches -= 1
+        if flags:
+            self.__flagged_watches += 1
+
+        watch = INotifyWatch(wd, path, inode_path, mask, flags)
+        self.__watches[wd] = watch
+        self.__path_to_wd[path] = wd
+        self.__inode_path_to_wd[inode_path] = wd
+
+        return watch
 
     def get_watch(self, wd):
         """Gets a watch.
@@ -361,6 +531,15 @@ class INotifyEnhanced(INotify):
 
         return self.__watches[wd]
 
+    def _get_missing_watch(self, wd):
+        """Get a watch that was not found.
+
+        Internal get_watch only called by get_events for an event on a watch
+        descriptor that has no watch, which may still be being added.
+        """
+
+        return self.__watches[wd]
+
     def get_watch_by_path(self, path):
         """Gets a watch.
 
@@ -376,11 +555,11 @@ class INotifyEnhanced(INotify):
         """
 
         try:
-            watch = self.__inode_paths_to_watches[path]
+            wd = self.__inode_path_to_wd[path]
         except KeyError:
-            watch = self.__paths_to_watches[path]
+            wd = self.__path_to_wd[path]
 
-        return watch
+        return self.__watches[wd]
 
     def get_all_watches(self):
         """Gets a list of current watches.
@@ -399,9 +578,18 @@ class INotifyEnhanced(INotify):
         result of unlinking a path) will trigger the IN_IGNORED event.
         """
 
-        del self.__inode_paths_to_watches[watch.inode_path]
-        del self.__paths_to_watches[watch.path]
-        del self.__watches[watch.wd]
+        wd = watch.wd
+
+        # the path entries may already refer to a newer watch on the same path
+        if self.__inode_path_to_wd.get(watch.inode_path) == wd:
+            del self.__inode_path_to_wd[watch.inode_path]
+        if self.__path_to_wd.get(watch.path) == wd:
+            del self.__path_to_wd[watch.path]
+
+        del self.__watches[wd]
+
+        if watch.flags:
+            self.__flagged_watches -= 1
 
     def rm_watch(self, watch):
         """Removes a watch.
@@ -437,61 +625,119 @@ class INotifyEnhanced(INotify):
         Note: See INotify.get_events() for further information.
         """
 
+        inotify_events = binding.get_events_typed(self._fd, timeout,
+            INotifyEvent, self._wake_fd)
+
+        # without enhanced flags on any watch there is nothing to auto add or
+        # auto remove, so skip checking for it on every event
+        if not self.__flagged_watches:
+            return self._match_events(inotify_events)
+
+        # bind hot names locally, avoiding global and attribute lookups for
+        # every event in the loop below
+        overflow = IN_Q_OVERFLOW
+        ignored = IN_IGNORED
+        watches = self.__watches
+        rm_watch = self._rm_watch
+
         events = []
-        for wd, mask, cookie, name in INotify.get_events(self, timeout):
-            if mask & IN_Q_OVERFLOW and wd == -1:
-                events.append((None, INotifyEvent(wd, mask, cookie, name)))
-                continue
+        append = events.append
+        for event in inotify_events:
+            wd = event.wd
+            mask = event.mask
 
-            watch = self.get_watch(wd)
+            if mask & overflow and wd == -1:
+                append((None, event))
+                continue
 
-            # get event and watch
-            event = INotifyEvent(wd, mask, cookie, name)
+            # get watch
+            watch = watches.get(wd)
+            if watch is None:
+                watch = self._get_missing_watch(wd)
 
             # auto remove
-            if mask & IN_IGNORED:
-                self._rm_watch(watch)
+            if mask & ignored:
+                rm_watch(watch)
 
             # auto remove moved
-            if watch.flags & INE_REMOVE_MOVED and mask & IN_MOVE_SELF:
+            if mask & watch._move_self_bits:
                 try:
                     self.rm_watch(watch)
                 except IOError:
                     pass
 
-            # auto add
-            if watch.flags & INE_AUTO_ADD and mask & (IN_CREATE | IN_MOVED_TO):
-          
-                # use path or inode path
-                path = os.path.join(watch.path, name)
-                inode_path = os.path.join(watch.inode_path, name)
+            # auto add (the directory check is left to add_watches, which
+            # skips anything that cannot be listed, to save a stat per event)
+            if mask & watch._auto_add_bits:
+                if mask & IN_ISDIR or not watch.mask & IN_DONT_FOLLOW:
+                    self._auto_add_watches(watch, event.name)
 
-                # check for directory creation
-                if mask & IN_ISDIR:
-                    try:
-                        self.add_watches(path, watch.mask, watch.flags, True)
-                    except IOError:
-                        try:
-                            self.add_watches(inode_path, watch.mask, watch.flags, True)
-                        except IOError:
-                            pass
-
-                # check for symlink to directory creation
-                elif not mask & IN_DONT_FOLLOW and os.path.isdir(path):
-                    try:
-                        self.add_watches(path, watch.mask, watch.flags, True)
-                    except IOError:
-                        try:
-                            self.add_watches(inode_path, watch.mask, watch.flags, True)
-                        except IOError:
-                            pass
+            # check match on requested mask
+            if mask & watch.mask:
+                append((watch, event))
+
+        return events
+
+    def _match_events(self, inotify_events):
+        """Associate events with watches.
+
+        Internal version of the get_events loop used when no watch has
+        enhanced flags set, so only IN_IGNORED needs handling.
+        """
+
+        overflow = IN_Q_OVERFLOW
+        ignored = IN_IGNORED
+        watches = self.__watches
+        rm_watch = self._rm_watch
+
+        events = []
+        append = events.append
+        for event in inotify_events:
+            mask = event.mask
+
+            if mask & overflow and event.wd == -1:
+                append((None, event))
+                continue
+
+            watch = watches.get(event.wd)
+            if watch is None:
+                watch = self._get_missing_watch(event.wd)
+
+            # auto remove
+            if mask & ignored:
+                rm_watch(watch)
 
             # check match on requested mask
             if mask & watch.mask:
-                events.append((watch, event))
+                append((watch, event))
 
         return events
 
+    def _auto_add_watches(self, watch, name):
+        """Add watches to an entry created in (or moved to) a watch.
+
+        Internal add_watches only called when an auto add event is handled in
+        get_events. Nothing is added if the entry is not a directory. If the
+        entry cannot be found via the path of the watch its inode path is
+        tried instead.
+        """
+
+        # use path or inode path
+        path = os.path.join(watch.path, name)
+        try:
+            error = self._add_watches(path, watch.mask, watch.flags, True)[1]
+        except IOError as e:
+            error = e.errno
+        if error != errno.ENOENT:
+            return
+
+        inode_path = os.path.join(watch.inode_path, name)
+        if inode_path != path:
+            try:
+                self._add_watches(inode_path, watch.mask, watch.flags, True)
+            except IOError:
+                pass
+
     def events(self, timeout=None):
         """Generator for inotify events.
 
@@ -512,6 +758,13 @@ class INotifyEnhanced(INotify):
 
 class INotifyThreaded(threading.Thread, INotifyEnhanced):
     """Threaded version of INotifyEnhanced.
+
+    Note: Only the methods that modify the watches being tracked take a lock.
+        Adding watches holds it from adding them to inotify until they are
+        tracked, and get_events() only takes it to look up a watch descriptor
+        that has no watch yet. get_watch(), get_watch_by_path() and
+        get_all_watches() are lock free as they rely on single dict operations
+        being atomic under the CPython GIL.
     """
 
     def __init__(self, callback=None):
@@ -519,16 +772,18 @@ class INotifyThreaded(threading.Thread, INotifyEnhanced):
         threading.Thread.__init__(self)
         INotifyEnhanced.__init__(self)
         
-        self.__lock = threading.Lock()
+        self.__lock = threading.RLock()
         self.__callback = callback
-        self.__running = False
+
+        # set until stop() so that stopping before run() starts is not lost
+        self.__running = True
 
     def add_watch(self, path, mask=IN_ALL_EVENTS, flags=0):
         """Adds a new watch, or modifies an existing watch.
 
         Same as INotifyEnhanced.add_watch() but thread safe.
         """
-        
+
         self.__lock.acquire()
         try:
             watch = INotifyEnhanced.add_watch(self, path, mask, flags)
@@ -537,48 +792,36 @@ class INotifyThreaded(threading.Thread, INotifyEnhanced):
 
         return watch
 
-    def get_watch(self, wd):
-        """Gets a watch.
+    def _add_watches(self, path, mask, flags, topdown):
+        """Recursively adds new watches, or modifies existing watches.
 
-        Same as INotifyEnhanced.get_watch() but thread safe.
+        Same as INotifyEnhanced._add_watches() but thread safe.
         """
 
         self.__lock.acquire()
         try:
-            watch = INotifyEnhanced.get_watch(self, wd)
+            result = INotifyEnhanced._add_watches(self, path, mask, flags,
+                topdown)
         finally:
             self.__lock.release()
 
-        return watch
+        return result
 
-    def get_watch_by_path(self, path):
-        """Gets a watch.
+    def _get_missing_watch(self, wd):
+        """Get a watch that was not found.
 
-        Same as INotifyEnhanced.get_watch_by_path() but thread safe.
+        Same as INotifyEnhanced._get_missing_watch() but waits for any watches
+        being added to be tracked.
         """
 
         self.__lock.acquire()
         try:
-            watch = INotifyEnhanced.get_watch_by_path(self, path)
+            watch = INotifyEnhanced._get_missing_watch(self, wd)
         finally:
             self.__lock.release()
 
         return watch
 
-    def get_all_watches(self):
-        """Gets a list of current watches.
-
-        Same as INotifyEnhanced.get_all_watches() but thread safe.
-        """
-
-        self.__lock.acquire()
-        try:
-            watches = INotifyEnhanced.get_all_watches(self)
-        finally:
-            self.__lock.release()
-
-        return watches
-
     def _rm_watch(self, watch):
         """Remove watch.
 
@@ -598,11 +841,12 @@ class INotifyThreaded(threading.Thread, INotifyEnhanced):
 
     def run(self):
 
-        self.__running = True
-
         while self.__running:
 
-            for event in self.get_events(0.1):
+            # blocks until there are events or stop() wakes the thread
+            for event in self.get_events(None):
+                if not self.__running:
+                    break
                 self.handle_event(*event)
 
     def stop(self):
@@ -610,8 +854,19 @@ class INotifyThreaded(threading.Thread, INotifyEnhanced):
 
         Note: Removes all watches and closes the file descriptor for inotify.
             See INotify.close() for further information.
-        """
 
-        self.close()
+        Note: The file descriptors are only closed once the thread has stopped
+            using them. If called from the thread itself (i.e. from within a
+            callback) the thread is not joined, it stops as soon as the
+            callback returns.
+        """
 
         self.__running = False
+
+        if not self._closed:
+            binding.wake(self._wake_fd)
+
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+        self.close()
@@ -27,10 +27,168 @@
  */
 
 #include <Python.h>
-#include <sys/select.h>
+#include <structmember.h>
+#include <dirent.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <stdint.h>
+#include <time.h>
+#include <unistd.h>
+#include <poll.h>
+#include <sys/eventfd.h>
+#include <sys/stat.h>
 #include <sys/inotify.h>
+#include <stdlib.h>
+#include <string.h>
 
-#define BUF_LENGTH 4096
+/* largest possible single event */
+#define EVENT_MAX_LENGTH (sizeof(struct inotify_event) + NAME_MAX + 1)
+
+/* room for a burst of events to be drained in one call */
+#define BUF_LENGTH (4096 * sizeof(struct inotify_event) + NAME_MAX + 1)
+
+/*
+ * Per thread read buffer reused between calls so that it stays allocated and
+ * resident. Decoding may run arbitrary Python code which can re-enter
+ * get_events on the same thread, in which case a temporary buffer is used.
+ */
+static __thread char read_buffer[BUF_LENGTH];
+static __thread int read_buffer_busy = 0;
+
+static char *
+acquire_buffer(void)
+{
+    if (read_buffer_busy)
+        return PyMem_Malloc(BUF_LENGTH);
+
+    read_buffer_busy = 1;
+    return read_buffer;
+}
+
+static void
+release_buffer(char *buffer)
+{
+    if (buffer == read_buffer)
+        read_buffer_busy = 0;
+    else
+        PyMem_Free(buffer);
+}
+
+typedef struct {
+    PyObject_HEAD
+    int wd;
+    /* longs as T_LONG gives ints on Python 2, like the get_events() tuples */
+    long mask;
+    long cookie;
+    PyObject *name;
+} binding_EventObject;
+
+static PyObject *
+binding_Event_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"wd", "mask", "cookie", "name", NULL};
+
+    int wd;
+    unsigned int mask;
+    unsigned int cookie;
+    PyObject *name;
+
+    binding_EventObject *self;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "iIIO", kwlist, &wd, &mask,
+            &cookie, &name))
+        return NULL;
+
+    self = (binding_EventObject *)type->tp_alloc(type, 0);
+    if (self == NULL)
+        return NULL;
+
+    self->wd = wd;
+    self->mask = mask;
+    self->cookie = cookie;
+    Py_INCREF(name);
+    self->name = name;
+
+    return (PyObject *)self;
+}
+
+static void
+binding_Event_dealloc(binding_EventObject *self)
+{
+    Py_XDECREF(self->name);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *
+binding_Event_reduce(PyObject *self, PyObject *args)
+{
+    binding_EventObject *event = (binding_EventObject *)self;
+
+    return Py_BuildValue("(O(illO))", Py_TYPE(self), event->wd, event->mask,
+        event->cookie, event->name);
+}
+
+static PyMethodDef
+binding_Event_methods[] = {
+    {"__reduce__", binding_Event_reduce, METH_NOARGS, NULL},
+    {NULL}
+};
+
+static PyMemberDef
+binding_Event_members[] = {
+    {"wd",     T_INT,       offsetof(binding_EventObject, wd),     READONLY,
+        "Watch descriptor associated with event."},
+    {"mask",   T_LONG,      offsetof(binding_EventObject, mask),   READONLY,
+        "Event mask."},
+    {"cookie", T_LONG,      offsetof(binding_EventObject, cookie), READONLY,
+        "Event cookie."},
+    {"name",   T_OBJECT_EX, offsetof(binding_EventObject, name),   READONLY,
+        "Event name."},
+    {NULL}
+};
+
+static PyTypeObject
+binding_EventType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "inotify.binding.Event",                    /* tp_name */
+    sizeof(binding_EventObject),                /* tp_basicsize */
+    0,                                          /* tp_itemsize */
+    (destructor)binding_Event_dealloc,          /* tp_dealloc */
+    0,                                          /* tp_print */
+    0,                                          /* tp_getattr */
+    0,                                          /* tp_setattr */
+    0,                                          /* tp_compare */
+    0,                                          /* tp_repr */
+    0,                                          /* tp_as_number */
+    0,                                          /* tp_as_sequence */
+    0,                                          /* tp_as_mapping */
+    0,                                          /* tp_hash */
+    0,                                          /* tp_call */
+    0,                                          /* tp_str */
+    0,                                          /* tp_getattro */
+    0,                                          /* tp_setattro */
+    0,                                          /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,   /* tp_flags */
+    "Inotify event with its fields stored as C values.", /* tp_doc */
+    0,                                          /* tp_traverse */
+    0,                                          /* tp_clear */
+    0,                                          /* tp_richcompare */
+    0,                                          /* tp_weaklistoffset */
+    0,                                          /* tp_iter */
+    0,                                          /* tp_iternext */
+    binding_Event_methods,                      /* tp_methods */
+    binding_Event_members,                      /* tp_members */
+    0,                                          /* tp_getset */
+    0,                                          /* tp_base */
+    0,                                          /* tp_dict */
+    0,                                          /* tp_descr_get */
+    0,                                          /* tp_descr_set */
+    0,                                          /* tp_dictoffset */
+    0,                                          /* tp_init */
+    0,                                          /* tp_alloc */
+    binding_Event_new,                          /* tp_new */
+};
 
 static PyObject *
 binding_init(PyObject *self, PyObject *args)
@@ -38,7 +196,7 @@ binding_init(PyObject *self, PyObject *args)
     int fd;
 
     Py_BEGIN_ALLOW_THREADS;
-    fd = inotify_init();
+    fd = inotify_init1(IN_NONBLOCK);
     Py_END_ALLOW_THREADS;
 
     if (fd == -1)
@@ -47,6 +205,60 @@ binding_init(PyObject *self, PyObject *args)
     return Py_BuildValue("i", fd);
 }
 
+static PyObject *
+binding_close(PyObject *self, PyObject *args)
+{
+    int fd;
+
+    if (!PyArg_ParseTuple(args, "i", &fd))
+        return NULL;
+
+    /* errors are ignored, the descriptor is released even if close fails and
+     * there is nothing useful a caller (usually __del__) can do about it */
+    Py_BEGIN_ALLOW_THREADS;
+    close(fd);
+    Py_END_ALLOW_THREADS;
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+binding_init_wake(PyObject *self, PyObject *args)
+{
+    int fd;
+
+    Py_BEGIN_ALLOW_THREADS;
+    fd = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+    Py_END_ALLOW_THREADS;
+
+    if (fd == -1)
+        return PyErr_SetFromErrno(PyExc_IOError);
+
+    return Py_BuildValue("i", fd);
+}
+
+static PyObject *
+binding_wake(PyObject *self, PyObject *args)
+{
+    int fd;
+    uint64_t value = 1;
+
+    int result;
+
+    if (!PyArg_ParseTuple(args, "i", &fd))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS;
+    result = write(fd, &value, sizeof(value));
+    Py_END_ALLOW_THREADS;
+
+    /* a saturated counter means a wake up is already pending */
+    if (result == -1 && errno != EAGAIN)
+        return PyErr_SetFromErrno(PyExc_IOError);
+
+    Py_RETURN_NONE;
+}
+
 static PyObject *
 binding_add_watch(PyObject *self, PyObject *args)
 {
@@ -71,6 +283,203 @@ binding_add_watch(PyObject *self, PyObject *args)
     return Py_BuildValue("i", wd);
 }
 
+/*
+ * Lists the directories within path (following symlinks if requested) into a
+ * malloc'd buffer of consecutive NUL terminated names. Returns the number of
+ * bytes used or -1 with errno set if path could not be opened. Must be called
+ * without the GIL held.
+ */
+static ssize_t
+list_dirs(const char *path, int follow, char **names_p)
+{
+    DIR *dir;
+    struct dirent *entry_p;
+    struct stat st;
+    int is_dir;
+    char *names = NULL;
+    char *tmp;
+    size_t length = 0;
+    size_t size = 0;
+    size_t n;
+
+    dir = opendir(path);
+    if (dir == NULL)
+        return -1;
+
+    while ((entry_p = readdir(dir)) != NULL)
+    {
+        if (strcmp(entry_p->d_name, ".") == 0 ||
+                strcmp(entry_p->d_name, "..") == 0)
+            continue;
+
+        /* only stat when d_type is not enough to decide */
+        is_dir = entry_p->d_type == DT_DIR;
+        if (entry_p->d_type == DT_UNKNOWN ||
+                (follow && entry_p->d_type == DT_LNK))
+            is_dir = fstatat(dirfd(dir), entry_p->d_name, &st,
+                follow ? 0 : AT_SYMLINK_NOFOLLOW) == 0 && S_ISDIR(st.st_mode);
+
+        if (!is_dir)
+            continue;
+
+        n = strlen(entry_p->d_name) + 1;
+        if (length + n > size)
+        {
+            size = 2 * (length + n);
+            tmp = realloc(names, size);
+            if (tmp == NULL)
+            {
+                free(names);
+                closedir(dir);
+                errno = ENOMEM;
+                return -1;
+            }
+            names = tmp;
+        }
+
+        memcpy(names + length, entry_p->d_name, n);
+        length += n;
+    }
+
+    closedir(dir);
+
+    *names_p = names;
+    return length;
+}
+
+/*
+ * Recursively adds watches to the directory in path (a PATH_MAX buffer that
+ * is extended in place for children) and appends a (wd, path) tuple for each
+ * watch added to results. Like os.walk() directories that cannot be listed
+ * are skipped, if list_errno is not NULL it is set to the errno path could not
+ * be listed with (or 0). Returns 0 on success or -1 with an exception set on
+ * error.
+ */
+static int
+add_watch_tree(int fd, char *path, size_t path_length, uint32_t mask,
+    int follow, int topdown, PyObject *results, int *list_errno)
+{
+    char *names = NULL;
+    ssize_t names_length;
+    char *name;
+    size_t name_length;
+    size_t child_offset;
+    int wd = -1;
+    int result = 0;
+    PyObject *result_o;
+
+    Py_BEGIN_ALLOW_THREADS;
+    names_length = list_dirs(path, follow, &names);
+    if (list_errno != NULL)
+        *list_errno = names_length == -1 ? errno : 0;
+    if (names_length != -1 && topdown)
+        wd = inotify_add_watch(fd, path, mask);
+    Py_END_ALLOW_THREADS;
+
+    if (names_length == -1)
+        return 0;
+
+    if (topdown)
+    {
+        if (wd == -1)
+        {
+            free(names);
+            PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+            return -1;
+        }
+
+        result_o = Py_BuildValue("is", wd, path);
+        if (result_o == NULL || PyList_Append(results, result_o) == -1)
+        {
+            Py_XDECREF(result_o);
+            free(names);
+            return -1;
+        }
+        Py_DECREF(result_o);
+    }
+
+    /* like os.path.join() no separator is added after a trailing slash */
+    child_offset = path_length;
+    if (path_length > 0 && path[path_length - 1] != '/')
+        path[child_offset++] = '/';
+
+    for (name = names; name < names + names_length; name += name_length + 1)
+    {
+        name_length = strlen(name);
+
+        /* paths that are too long could not be listed anyway */
+        if (child_offset + name_length >= PATH_MAX)
+            continue;
+
+        memcpy(path + child_offset, name, name_length + 1);
+
+        result = add_watch_tree(fd, path, child_offset + name_length, mask,
+            follow, topdown, results, NULL);
+
+        if (result == -1)
+            break;
+    }
+
+    path[path_length] = '\0';
+    free(names);
+
+    if (result == -1 || topdown)
+        return result;
+
+    Py_BEGIN_ALLOW_THREADS;
+    wd = inotify_add_watch(fd, path, mask);
+    Py_END_ALLOW_THREADS;
+
+    if (wd == -1)
+    {
+        PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+        return -1;
+    }
+
+    result_o = Py_BuildValue("is", wd, path);
+    if (result_o == NULL || PyList_Append(results, result_o) == -1)
+    {
+        Py_XDECREF(result_o);
+        return -1;
+    }
+    Py_DECREF(result_o);
+
+    return 0;
+}
+
+static PyObject *
+binding_add_watch_tree(PyObject *self, PyObject *args)
+{
+    int fd;
+    char *path;
+    uint32_t mask;
+    int topdown;
+    PyObject *results;
+
+    char buffer[PATH_MAX];
+    size_t length;
+    int list_errno;
+
+    if (!PyArg_ParseTuple(args, "isIiO!", &fd, &path, &mask, &topdown,
+            &PyList_Type, &results))
+        return NULL;
+
+    length = strlen(path);
+    if (length >= sizeof(buffer))
+    {
+        errno = ENAMETOOLONG;
+        return PyErr_SetFromErrnoWithFilename(PyExc_IOError, path);
+    }
+
+    memcpy(buffer, path, length + 1);
+
+    if (add_watch_tree(fd, buffer, length, mask, !(mask & IN_DONT_FOLLOW),
+            topdown, results, &list_errno) == -1)
+        return NULL;
+
+    return Py_BuildValue("i", list_errno);
+}
+
 static PyObject *
 binding_rm_watch(PyObject *self, PyObject *args)
 {
@@ -91,64 +500,171 @@ binding_rm_watch(PyObject *self, PyObject *args)
 
     Py_RETURN_NONE;
 }
-static PyObject *
-binding_get_events(PyObject *self, PyObject *args)
+
+/*
+ * Drains the (non-blocking) fd into buffer until it is empty or there is no
+ * longer room for a maximum sized event. Returns the number of bytes read, 0
+ * if the buffer is too small for the next event or -1 with errno set (to
+ * EAGAIN if there were no events). Errors after a partial drain are left to
+ * be reported by the next call. Must be called without the GIL held.
+ */
+static ssize_t
+drain_events(int fd, char *buffer, size_t size)
 {
-    int fd;
-    PyObject *timeout_o = NULL;
+    ssize_t result;
+    size_t length = 0;
+
+    do
+    {
+        result = read(fd, buffer + length, size - length);
+        if (result > 0)
+            length += result;
+    }
+    while (result > 0 && size - length >= EVENT_MAX_LENGTH);
+
+    if (length > 0)
+        return length;
+
+    return result;
+}
 
+/*
+ * Reads any queued events on fd into buffer. If there are none waits up to
+ * timeout_o seconds (None blocks) for events, or until wake_fd (an eventfd,
+ * ignored if negative) is signalled, and then reads them. Returns the number
+ * of bytes read, 0 on timeout or wake up or -1 with an exception set on
+ * error.
+ */
+static int
+read_events(int fd, int wake_fd, PyObject *timeout_o, char *buffer,
+    size_t size)
+{
     double timeout_d;
-    struct timeval timeout_s;
-    struct timeval *timeout_p = NULL;
-    fd_set fds;
+    struct timespec timeout_s;
+    struct timespec *timeout_p = NULL;
+    struct timespec deadline;
+    struct timespec now;
+    struct pollfd fds[2];
+    uint64_t value;
     int result;
-    char buffer[BUF_LENGTH];
-    int length;
-    struct inotify_event *event_p;
-    PyObject *event_o = NULL;
-    PyObject *events = NULL;
+    int error;
+    ssize_t length;
 
-    if (!PyArg_ParseTuple(args, "i|O", &fd, &timeout_o))
-        return NULL;
-
-    if (timeout_o != Py_None)
+    if (timeout_o != NULL && timeout_o != Py_None)
     {
         timeout_d = PyFloat_AsDouble(timeout_o);
         if (PyErr_Occurred() != NULL)
-            return NULL;
+            return -1;
 
-        timeout_s.tv_sec = (int)timeout_d;
-        timeout_s.tv_usec = (int)(1000000.0 * (timeout_d - (double)timeout_s.tv_sec));
+        if (timeout_d < 0.0)
+            timeout_d = 0.0;
+
+        timeout_s.tv_sec = (time_t)timeout_d;
+        timeout_s.tv_nsec = (long)(1e9 * (timeout_d - (double)timeout_s.tv_sec));
         timeout_p = &timeout_s;
-    } 
 
-    FD_ZERO(&fds);
-    FD_SET(fd, &fds);
+        /* deadline for resuming the wait after a signal */
+        clock_gettime(CLOCK_MONOTONIC, &deadline);
+        deadline.tv_sec += timeout_s.tv_sec;
+        deadline.tv_nsec += timeout_s.tv_nsec;
+        if (deadline.tv_nsec >= 1000000000L)
+        {
+            deadline.tv_sec++;
+            deadline.tv_nsec -= 1000000000L;
+        }
+    }
 
-    Py_BEGIN_ALLOW_THREADS;
-    result = select(fd + 1, &fds, NULL, NULL, timeout_p);
-    Py_END_ALLOW_THREADS;
+    fds[0].fd = fd;
+    fds[0].events = POLLIN;
+    fds[1].fd = wake_fd;
+    fds[1].events = POLLIN;
 
-    if (result == -1)
-        return PyErr_SetFromErrno(PyExc_IOError);
+    for (;;)
+    {
+        fds[0].revents = 0;
+        fds[1].revents = 0;
 
-    if (result == 0)
-        return PyList_New(0);
+        /* no Python API calls may be made in here */
+        Py_BEGIN_ALLOW_THREADS;
 
-    Py_BEGIN_ALLOW_THREADS;
-    length = read(fd, buffer, sizeof(buffer));
-    Py_END_ALLOW_THREADS;
+        /* a busy fd usually has events queued already, so only poll when the
+         * optimistic read would block */
+        length = drain_events(fd, buffer, size);
+        error = errno;
+        if (length == -1 && error == EAGAIN)
+        {
+            result = ppoll(fds, wake_fd < 0 ? 1 : 2, timeout_p, NULL);
+            error = errno;
+            if (result > 0 && fds[1].revents & POLLIN)
+                read(wake_fd, &value, sizeof(value));
+
+            if (result > 0 && fds[0].revents)
+            {
+                length = drain_events(fd, buffer, size);
+                error = errno;
+            }
+            else if (result != -1)
+                error = EAGAIN;
+        }
 
-    if (length == -1)
-        return PyErr_SetFromErrno(PyExc_IOError);
+        Py_END_ALLOW_THREADS;
 
-    if (length == 0)
+        if (length != -1 || error != EINTR)
+            break;
+
+        /* interrupted by a signal, give its handler a chance to raise and
+         * otherwise resume waiting for whatever time remains */
+        if (PyErr_CheckSignals() != 0)
+            return -1;
+
+        if (timeout_p != NULL)
+        {
+            clock_gettime(CLOCK_MONOTONIC, &now);
+            timeout_s.tv_sec = deadline.tv_sec - now.tv_sec;
+            timeout_s.tv_nsec = deadline.tv_nsec - now.tv_nsec;
+            if (timeout_s.tv_nsec < 0)
+            {
+                timeout_s.tv_sec--;
+                timeout_s.tv_nsec += 1000000000L;
+            }
+            if (timeout_s.tv_sec < 0)
+            {
+                timeout_s.tv_sec = 0;
+                timeout_s.tv_nsec = 0;
+            }
+        }
+    }
+
+    if (length > 0)
+        return length;
+
+    if (length == -1)
     {
-        PyErr_SetString(PyExc_IOError, "event buffer too small");
-        return NULL;
+        if (error == EAGAIN)
+            return 0;
+
+        errno = error;
+        PyErr_SetFromErrno(PyExc_IOError);
+        return -1;
     }
 
+    PyErr_SetString(PyExc_IOError, "event buffer too small");
+    return -1;
+}
+
+#define NEXT_EVENT(event_p) \
+    ((struct inotify_event *)((char *)((event_p) + 1) + (event_p)->len))
+
+static PyObject *
+decode_events(char *buffer, int length)
+{
+    struct inotify_event *event_p;
+    PyObject *event_o = NULL;
+    PyObject *events = NULL;
+
     events = PyList_New(0);
+    if (events == NULL)
+        return NULL;
 
     event_p = (struct inotify_event *)buffer;
     while ((char *)event_p < buffer + length)
@@ -159,38 +675,289 @@ binding_get_events(PyObject *self, PyObject *args)
         else
             event_o = Py_BuildValue("iiis", event_p->wd, event_p->mask,
                 event_p->cookie, "");
-        
-        if (PyList_Append(events, event_o) == -1)
+
+        if (event_o == NULL || PyList_Append(events, event_o) == -1)
         {
-            Py_DECREF(event_o);
+            Py_XDECREF(event_o);
             Py_DECREF(events);
             return NULL;
         }
 
         Py_DECREF(event_o);
 
-        event_p = (struct inotify_event *)((char *)(event_p + 1) + event_p->len);
+        event_p = NEXT_EVENT(event_p);
+    }
+
+    return events;
+}
+
+static PyObject *
+decode_events_typed(char *buffer, int length, PyObject *type_o)
+{
+    int native;
+    Py_ssize_t count;
+    Py_ssize_t i;
+    struct inotify_event *event_p;
+    binding_EventObject *native_p;
+    PyObject *event_o = NULL;
+    PyObject *events = NULL;
+
+    /* subtypes of Event are filled in directly rather than called */
+    native = PyType_Check(type_o) &&
+        PyType_IsSubtype((PyTypeObject *)type_o, &binding_EventType);
+
+    count = 0;
+    event_p = (struct inotify_event *)buffer;
+    while ((char *)event_p < buffer + length)
+    {
+        count++;
+        event_p = NEXT_EVENT(event_p);
+    }
+
+    events = PyList_New(count);
+    if (events == NULL)
+        return NULL;
+
+    event_p = (struct inotify_event *)buffer;
+    for (i = 0; i < count; i++)
+    {
+        if (native)
+        {
+            native_p = (binding_EventObject *)((PyTypeObject *)type_o)->tp_alloc(
+                (PyTypeObject *)type_o, 0);
+            if (native_p != NULL)
+            {
+                native_p->wd = event_p->wd;
+                native_p->mask = event_p->mask;
+                native_p->cookie = event_p->cookie;
+                native_p->name = PyString_FromStringAndSize(event_p->name,
+                    strnlen(event_p->name, event_p->len));
+                if (native_p->name == NULL)
+                    Py_CLEAR(native_p);
+            }
+            event_o = (PyObject *)native_p;
+        }
+        else
+            event_o = PyObject_CallFunction(type_o, "iIIs#", event_p->wd,
+                event_p->mask, event_p->cookie, event_p->name,
+                (int)strnlen(event_p->name, event_p->len));
+
+        if (event_o == NULL)
+        {
+            Py_DECREF(events);
+            return NULL;
+        }
+
+        PyList_SET_ITEM(events, i, event_o);
+
+        event_p = NEXT_EVENT(event_p);
+    }
+
+    return events;
+}
+
+/* array.array, looked up when the module is initialised */
+static PyObject *array_type = NULL;
+
+static PyObject *
+decode_events_columns(char *buffer, int length)
+{
+    Py_ssize_t count;
+    Py_ssize_t i;
+    struct inotify_event *event_p;
+    PyObject *wds_s = NULL;
+    PyObject *masks_s = NULL;
+    PyObject *cookies_s = NULL;
+    PyObject *names = NULL;
+    PyObject *wds_a = NULL;
+    PyObject *masks_a = NULL;
+    PyObject *cookies_a = NULL;
+    PyObject *name_o;
+    int *wds_p;
+    unsigned int *masks_p;
+    unsigned int *cookies_p;
+    PyObject *columns = NULL;
+
+    count = 0;
+    event_p = (struct inotify_event *)buffer;
+    while ((char *)event_p < buffer + length)
+    {
+        count++;
+        event_p = NEXT_EVENT(event_p);
     }
 
+    wds_s = PyString_FromStringAndSize(NULL, count * sizeof(int));
+    masks_s = PyString_FromStringAndSize(NULL, count * sizeof(unsigned int));
+    cookies_s = PyString_FromStringAndSize(NULL, count * sizeof(unsigned int));
+    names = PyList_New(count);
+    if (wds_s == NULL || masks_s == NULL || cookies_s == NULL || names == NULL)
+        goto done;
+
+    wds_p = (int *)PyString_AS_STRING(wds_s);
+    masks_p = (unsigned int *)PyString_AS_STRING(masks_s);
+    cookies_p = (unsigned int *)PyString_AS_STRING(cookies_s);
+
+    event_p = (struct inotify_event *)buffer;
+    for (i = 0; i < count; i++)
+    {
+        wds_p[i] = event_p->wd;
+        masks_p[i] = event_p->mask;
+        cookies_p[i] = event_p->cookie;
+
+        name_o = PyString_FromStringAndSize(event_p->name,
+            strnlen(event_p->name, event_p->len));
+        if (name_o == NULL)
+            goto done;
+        PyList_SET_ITEM(names, i, name_o);
+
+        event_p = NEXT_EVENT(event_p);
+    }
+
+    /* array.array copies the raw machine values from the strings */
+    wds_a = PyObject_CallFunction(array_type, "sO", "i", wds_s);
+    masks_a = PyObject_CallFunction(array_type, "sO", "I", masks_s);
+    cookies_a = PyObject_CallFunction(array_type, "sO", "I", cookies_s);
+    if (wds_a != NULL && masks_a != NULL && cookies_a != NULL)
+        columns = PyTuple_Pack(4, wds_a, masks_a, cookies_a, names);
+
+done:
+    Py_XDECREF(wds_a);
+    Py_XDECREF(masks_a);
+    Py_XDECREF(cookies_a);
+    Py_XDECREF(wds_s);
+    Py_XDECREF(masks_s);
+    Py_XDECREF(cookies_s);
+    Py_XDECREF(names);
+
+    return columns;
+}
+
+static PyObject *
+binding_get_events(PyObject *self, PyObject *args)
+{
+    int fd;
+    PyObject *timeout_o = NULL;
+    int wake_fd = -1;
+
+    char *buffer;
+    int length;
+    PyObject *events = NULL;
+
+    if (!PyArg_ParseTuple(args, "i|Oi", &fd, &timeout_o, &wake_fd))
+        return NULL;
+
+    buffer = acquire_buffer();
+    if (buffer == NULL)
+        return PyErr_NoMemory();
+
+    length = read_events(fd, wake_fd, timeout_o, buffer, BUF_LENGTH);
+    if (length > 0)
+        events = decode_events(buffer, length);
+    else if (length == 0)
+        events = PyList_New(0);
+
+    release_buffer(buffer);
+
+    return events;
+}
+
+static PyObject *
+binding_get_events_typed(PyObject *self, PyObject *args)
+{
+    int fd;
+    PyObject *timeout_o = NULL;
+    PyObject *type_o;
+    int wake_fd = -1;
+
+    char *buffer;
+    int length;
+    PyObject *events = NULL;
+
+    if (!PyArg_ParseTuple(args, "iOO|i", &fd, &timeout_o, &type_o, &wake_fd))
+        return NULL;
+
+    buffer = acquire_buffer();
+    if (buffer == NULL)
+        return PyErr_NoMemory();
+
+    length = read_events(fd, wake_fd, timeout_o, buffer, BUF_LENGTH);
+    if (length > 0)
+        events = decode_events_typed(buffer, length, type_o);
+    else if (length == 0)
+        events = PyList_New(0);
+
+    release_buffer(buffer);
+
     return events;
 }
 
+static PyObject *
+binding_get_events_columns(PyObject *self, PyObject *args)
+{
+    int fd;
+    PyObject *timeout_o = NULL;
+    int wake_fd = -1;
+
+    char *buffer;
+    int length;
+    PyObject *columns = NULL;
+
+    if (!PyArg_ParseTuple(args, "i|Oi", &fd, &timeout_o, &wake_fd))
+        return NULL;
+
+    buffer = acquire_buffer();
+    if (buffer == NULL)
+        return PyErr_NoMemory();
+
+    length = read_events(fd, wake_fd, timeout_o, buffer, BUF_LENGTH);
+    if (length >= 0)
+        columns = decode_events_columns(buffer, length);
+
+    release_buffer(buffer);
+
+    return columns;
+}
+
 static PyMethodDef
 bindingMethods[] = {
     {"init",       binding_init,       METH_VARARGS, NULL},
+    {"init_wake",  binding_init_wake,  METH_VARARGS, NULL},
+    {"close",      binding_close,      METH_VARARGS, NULL},
+    {"wake",       binding_wake,       METH_VARARGS, NULL},
     {"add_watch",  binding_add_watch,  METH_VARARGS, NULL},
+    {"add_watch_tree", binding_add_watch_tree, METH_VARARGS, NULL},
     {"rm_watch",   binding_rm_watch,   METH_VARARGS, NULL},
     {"get_events", binding_get_events, METH_VARARGS, NULL},
+    {"get_events_typed", binding_get_events_typed, METH_VARARGS, NULL},
+    {"get_events_columns", binding_get_events_columns, METH_VARARGS, NULL},
     {NULL, NULL, 0, NULL}
 };
 
 PyMODINIT_FUNC
 initbinding(void)
 {
-    PyObject* module = Py_InitModule("inotify.binding",  bindingMethods);
+    PyObject* module;
+    PyObject* array_module;
+
+    if (PyType_Ready(&binding_EventType) < 0)
+        return;
+
+    array_module = PyImport_ImportModule("array");
+    if (array_module == NULL)
+        return;
+
+    array_type = PyObject_GetAttrString(array_module, "array");
+    Py_DECREF(array_module);
+    if (array_type == NULL)
+        return;
+
+    module = Py_InitModule("inotify.binding",  bindingMethods);
 
     if (module == NULL)
         return;
+
+    Py_INCREF(&binding_EventType);
+    PyModule_AddObject(module, "Event", (PyObject *)&binding_EventType);
     
     PyModule_AddIntMacro(module, IN_ACCESS);
     PyModule_AddIntMacro(module, IN_MODIFY);